@@ -1,16 +1,70 @@
 from fastapi import Depends, HTTPException, status, Request
-from jose import jwt
+import jwt
 import requests
+import hashlib
 import os
-from typing import Optional
+import threading
+import time
+from typing import Any, Dict, Optional
 
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
 SUPABASE_PROJECT_ID = os.getenv("SUPABASE_PROJECT_ID")
 
+# Cache of verified token payloads so repeated requests with the same bearer
+# skip the HMAC verification and JSON parse. Keyed by a token hash, entries
+# expire with the token (capped at TOKEN_CACHE_TTL seconds). Failed
+# verifications are never cached.
+TOKEN_CACHE_TTL = 30
+TOKEN_CACHE_MAX_SIZE = 10000
+_token_cache: Dict[bytes, tuple] = {}
+_token_cache_lock = threading.Lock()
+
+def _token_cache_key(token: str) -> bytes:
+    """Compute a compact cache key for a bearer token"""
+    return hashlib.sha256(token.encode()).digest()[:16]
+
+def get_cached_token_payload(token: str) -> Optional[Dict[str, Any]]:
+    """Get a previously verified payload for a token, if still fresh"""
+    key = _token_cache_key(token)
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, payload = entry
+        if time.time() >= expires_at:
+            del _token_cache[key]
+            return None
+        return payload
+
+def cache_token_payload(token: str, payload: Dict[str, Any]):
+    """Cache a verified payload until the token expires (capped at the TTL)"""
+    ttl = TOKEN_CACHE_TTL
+    exp = payload.get("exp")
+    if exp is not None:
+        ttl = min(exp - time.time(), TOKEN_CACHE_TTL)
+    if ttl <= 0:
+        return
+    key = _token_cache_key(token)
+    with _token_cache_lock:
+        if len(_token_cache) >= TOKEN_CACHE_MAX_SIZE:
+            # Drop expired entries; clear everything if the cache is still full
+            now = time.time()
+            for stale_key in [k for k, (e, _) in _token_cache.items() if e <= now]:
+                del _token_cache[stale_key]
+            if len(_token_cache) >= TOKEN_CACHE_MAX_SIZE:
+                _token_cache.clear()
+        _token_cache[key] = (time.time() + ttl, payload)
+
 def get_current_user(request: Request) -> str:
     """
     Verify Supabase JWT token and return user ID
     """
+    # Always verify here even though AuthenticationMiddleware already
+    # decoded the token: the middleware checks against
+    # SECURITY_SECRET_KEY with no audience, not the Supabase secret and
+    # audience/claims this dependency requires, so its verdict cannot be
+    # substituted for this one. The token cache below keeps the repeated
+    # decode cheap.
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         raise HTTPException(
@@ -18,17 +72,24 @@ def get_current_user(request: Request) -> str:
             detail="Missing or invalid authorization header"
         )
     
-    token = auth_header.split(" ")[1]
-    
+    # Slice off the "Bearer " prefix directly - split() would allocate a
+    # list and mishandle doubled spaces
+    token = auth_header[7:]
+
     try:
-        # Decode the JWT token
-        payload = jwt.decode(
-            token, 
-            SUPABASE_JWT_SECRET, 
-            algorithms=["HS256"],
-            audience=SUPABASE_PROJECT_ID
-        )
-        
+        # Reuse a cached payload if this token was verified recently
+        payload = get_cached_token_payload(token)
+        if payload is None:
+            # Decode the JWT token
+            payload = jwt.decode(
+                token,
+                SUPABASE_JWT_SECRET,
+                algorithms=["HS256"],
+                audience=SUPABASE_PROJECT_ID,
+                options={"require": ["exp", "sub"]}
+            )
+            cache_token_payload(token, payload)
+
         # Extract user ID from the token
         user_id = payload.get("sub")
         if not user_id:
@@ -44,7 +105,7 @@ def get_current_user(request: Request) -> str:
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has expired"
         )
-    except jwt.JWTError as e:
+    except jwt.InvalidTokenError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Invalid token: {str(e)}"
@@ -1,5 +1,5 @@
 import os
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Final
 
 class SecurityConfig:
     def __init__(self):
@@ -14,18 +14,18 @@ class SecurityConfig:
         
         # File Upload Security
         self.max_file_size = int(os.getenv("MAX_FILE_SIZE", "52428800"))  # 50MB
-        self.allowed_file_types = [
+        self.allowed_file_types = frozenset({
             'pdf', 'txt', 'docx', 'dwg', 'dxf', 'rvt', 'rfa', 'dgn', 'skp'
-        ]
+        })
         
         # Database Security
         self.db_connection_limit = int(os.getenv("DB_CONNECTION_LIMIT", "10"))
         self.db_timeout = int(os.getenv("DB_TIMEOUT", "30"))
         
         # CORS Configuration
-        self.allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(",")
-        self.allowed_methods = ["GET", "POST", "PUT", "DELETE", "OPTIONS"]
-        self.allowed_headers = ["*"]
+        self.allowed_origins = tuple(os.getenv("ALLOWED_ORIGINS", "http://localhost:3000").split(","))
+        self.allowed_methods = ("GET", "POST", "PUT", "DELETE", "OPTIONS")
+        self.allowed_headers = ("*",)
         
         # Security Headers
         self.security_headers = {
@@ -48,7 +48,7 @@ class SecurityConfig:
         
         # API Security
         self.api_key_required = os.getenv("API_KEY_REQUIRED", "false").lower() == "true"
-        self.api_keys = os.getenv("API_KEYS", "").split(",") if os.getenv("API_KEYS") else []
+        self.api_keys = tuple(os.getenv("API_KEYS", "").split(",")) if os.getenv("API_KEYS") else ()
         
         # Session Security
         self.session_timeout = int(os.getenv("SESSION_TIMEOUT", "3600"))  # 1 hour
@@ -149,4 +149,15 @@ class SecurityConfig:
         }
 
 # Global security config instance
-security_config = SecurityConfig()
\ No newline at end of file
+security_config = SecurityConfig()
+
+# Values frozen at import so request paths never re-read the environment
+JWT_SECRET: Final[str] = security_config.jwt_secret
+JWT_ALGORITHM: Final[str] = security_config.jwt_algorithm
+JWT_EXPIRATION: Final[int] = security_config.jwt_expiration
+RATE_LIMIT_REQUESTS: Final[int] = security_config.rate_limit_requests
+RATE_LIMIT_WINDOW: Final[int] = security_config.rate_limit_window
+MAX_FILE_SIZE: Final[int] = security_config.max_file_size
+ALLOWED_FILE_TYPES: Final[frozenset] = security_config.allowed_file_types
+ALLOWED_ORIGINS: Final[tuple] = security_config.allowed_origins
+SECURITY_HEADERS: Final[Dict[str, str]] = security_config.security_headers
\ No newline at end of file
@@ -1,23 +1,117 @@
 import sqlite3
 import threading
 import logging
+import queue
+import time
 from contextlib import contextmanager
+from pattern_scan import MultiPatternScanner
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
 from typing import Optional, List, Dict, Any
+from datetime import datetime, timedelta
 import hashlib
 import os
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# All forbidden SQL patterns compiled once into a shared scanner so dynamic
+# SQL is checked in a single pass (SIMD-accelerated when hyperscan is
+# installed) instead of one substring search per pattern
+_SQL_SCANNER = MultiPatternScanner([
+    r"DROP\s+TABLE",
+    r"DELETE\s+FROM",
+    r"INSERT\s+INTO",
+    r"UPDATE\s+SET",
+    r"ALTER\s+TABLE",
+    r"CREATE\s+TABLE",
+    r"TRUNCATE",
+    r"EXEC(?:UTE)?",
+    r"UNION",
+    r"OR\s+1\s*=\s*1",
+    r"OR\s+TRUE",
+    r"AND\s+1\s*=\s*1",
+    r"AND\s+TRUE",
+])
+
+# Statements used on the hot paths, defined once so every call passes the
+# exact same string object and SQLite's internal statement cache can reuse
+# the parsed bytecode
+_SQL_INSERT_FILE = """
+    INSERT INTO files (id, user_id, filename, filepath, file_hash, file_size)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_SQL_INSERT_FILE_WITH_BOQ = """
+    INSERT INTO files (id, user_id, filename, filepath, file_hash, file_size, boq_data)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SQL_UPDATE_FILE_BOQ = """
+    UPDATE files
+    SET boq_data = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+"""
+
+_SQL_GET_USER_FILES = """
+    SELECT id, filename, uploaded_at, boq_data, file_size
+    FROM files
+    WHERE user_id = ?
+    ORDER BY uploaded_at DESC
+"""
+
+_SQL_GET_FILE_BY_ID = """
+    SELECT filepath, filename, boq_data
+    FROM files
+    WHERE id = ? AND user_id = ?
+"""
+
+_SQL_LOG_SECURITY_EVENT = """
+    INSERT INTO security_logs (event_type, ip_address, user_id, details, severity)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+_SQL_GET_FILE_HASH = "SELECT file_hash FROM files WHERE id = ?"
+
+_SQL_CLEANUP_OLD_LOGS = """
+    DELETE FROM security_logs
+    WHERE id IN (
+        SELECT id FROM security_logs
+        WHERE timestamp < ?
+        ORDER BY id
+        LIMIT 10000
+    )
+"""
+
 class SecureDatabase:
     def __init__(self, db_path: str = "boqmate.db"):
         self.db_path = db_path
-        self._lock = threading.Lock()
-        self._connection_pool = {}
-        self.max_connections = 10
-        
+        # One connection per thread, owned by the thread itself - no shared
+        # pool dict and no cross-thread eviction
+        self._tls = threading.local()
+
         # Initialize database with secure schema
         self._init_database()
+
+        # Security-log events are buffered here and flushed in batches by a
+        # background thread, so a burst of blocked requests costs one
+        # transaction instead of one fsync per event
+        # Read cache for file metadata: rows barely change after upload,
+        # so dashboard-style polling can be answered from memory. Entries
+        # live for the TTL or until a write invalidates them.
+        self._files_cache_ttl = 60
+        self._files_cache_max_size = 10000
+        self._files_cache = {}
+        self._files_cache_lock = threading.Lock()
+
+        self._log_batch_size = 500
+        self._log_flush_interval = 0.2  # seconds
+        self._log_queue = queue.SimpleQueue()
+        self._log_writer = threading.Thread(target=self._log_writer_loop, daemon=True)
+        self._log_writer.start()
     
     def _init_database(self):
         """Initialize database with secure schema"""
@@ -75,170 +169,218 @@ class SecureDatabase:
     
     @contextmanager
     def _get_connection(self):
-        """Get a database connection with proper error handling"""
-        thread_id = threading.get_ident()
-        
-        if thread_id not in self._connection_pool:
-            if len(self._connection_pool) >= self.max_connections:
-                # Remove oldest connection
-                oldest_thread = min(self._connection_pool.keys())
-                self._connection_pool[oldest_thread].close()
-                del self._connection_pool[oldest_thread]
-            
+        """Get this thread's database connection, creating it on first use"""
+        conn = getattr(self._tls, "conn", None)
+        if conn is None:
             conn = sqlite3.connect(self.db_path, check_same_thread=False)
             conn.row_factory = sqlite3.Row
             # Enable foreign key constraints
             conn.execute("PRAGMA foreign_keys = ON")
             # Enable WAL mode for better concurrency
             conn.execute("PRAGMA journal_mode = WAL")
+            # NORMAL sync is safe under WAL and much faster than FULL
+            conn.execute("PRAGMA synchronous = NORMAL")
+            # Keep temp tables and indices in memory
+            conn.execute("PRAGMA temp_store = MEMORY")
             # Set busy timeout
             conn.execute("PRAGMA busy_timeout = 30000")
-            
-            self._connection_pool[thread_id] = conn
-        
+
+            self._tls.conn = conn
+
         try:
-            yield self._connection_pool[thread_id]
+            yield conn
         except Exception as e:
             logger.error(f"Database error: {e}")
             raise
     
     def _sanitize_sql(self, sql: str) -> str:
-        """Sanitize SQL to prevent injection"""
-        # Remove any potential SQL injection patterns
-        dangerous_patterns = [
-            "DROP TABLE",
-            "DELETE FROM",
-            "INSERT INTO",
-            "UPDATE SET",
-            "ALTER TABLE",
-            "CREATE TABLE",
-            "TRUNCATE",
-            "EXEC",
-            "EXECUTE",
-            "UNION",
-            "OR 1=1",
-            "OR TRUE",
-            "AND 1=1",
-            "AND TRUE"
-        ]
-        
-        sql_upper = sql.upper()
-        for pattern in dangerous_patterns:
-            if pattern in sql_upper:
-                raise ValueError(f"Dangerous SQL pattern detected: {pattern}")
-        
+        """Sanitize SQL to prevent injection (single pass over the string)"""
+        match = _SQL_SCANNER.scan(sql)
+        if match:
+            raise ValueError(f"Dangerous SQL pattern detected: {match}")
         return sql
-    
-    def execute_query(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
-        """Execute a secure query"""
-        with self._lock:
-            sanitized_sql = self._sanitize_sql(sql)
-            
-            with self._get_connection() as conn:
-                cursor = conn.execute(sanitized_sql, params)
-                results = []
-                for row in cursor.fetchall():
-                    results.append(dict(row))
-                return results
-    
-    def execute_update(self, sql: str, params: tuple = ()) -> int:
+
+    def execute_query(self, sql: str, params: tuple = (), trusted: bool = False) -> List[sqlite3.Row]:
+        """Execute a secure query
+
+        Statements defined in this module are passed with trusted=True and
+        skip the pattern scan - it would otherwise reject our own DML.
+
+        No app-level lock here: per-thread connections plus WAL mode and the
+        busy_timeout let SQLite handle reader/writer coordination itself.
+        """
+        sanitized_sql = sql if trusted else self._sanitize_sql(sql)
+
+        with self._get_connection() as conn:
+            cursor = conn.execute(sanitized_sql, params)
+            # Rows already support row["col"] access via sqlite3.Row, so
+            # there is no need to copy each one into a dict
+            return cursor.fetchall()
+
+    def execute_update(self, sql: str, params: tuple = (), trusted: bool = False) -> int:
         """Execute a secure update"""
-        with self._lock:
-            sanitized_sql = self._sanitize_sql(sql)
-            
-            with self._get_connection() as conn:
-                cursor = conn.execute(sanitized_sql, params)
-                conn.commit()
-                return cursor.rowcount
+        sanitized_sql = sql if trusted else self._sanitize_sql(sql)
+
+        with self._get_connection() as conn:
+            cursor = conn.execute(sanitized_sql, params)
+            conn.commit()
+            return cursor.rowcount
     
+    def _files_cache_get(self, key: tuple):
+        """Get a cached metadata result, dropping it if expired"""
+        with self._files_cache_lock:
+            entry = self._files_cache.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.time() >= expires_at:
+                del self._files_cache[key]
+                return None
+            return value
+
+    def _files_cache_put(self, key: tuple, value):
+        """Cache a metadata result for the TTL"""
+        with self._files_cache_lock:
+            if len(self._files_cache) >= self._files_cache_max_size:
+                self._files_cache.clear()
+            self._files_cache[key] = (time.time() + self._files_cache_ttl, value)
+
+    def _invalidate_files_cache(self, user_id: str = None):
+        """Drop cached metadata for a user, or everything if unknown"""
+        with self._files_cache_lock:
+            if user_id is None:
+                self._files_cache.clear()
+            else:
+                for key in [k for k in self._files_cache if user_id in k]:
+                    del self._files_cache[key]
+
     def insert_file(self, file_id: str, user_id: str, filename: str, filepath: str, file_hash: str = None, file_size: int = None) -> bool:
         """Insert a file record securely"""
         try:
-            sql = """
-                INSERT INTO files (id, user_id, filename, filepath, file_hash, file_size)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """
-            self.execute_update(sql, (file_id, user_id, filename, filepath, file_hash, file_size))
+            self.execute_update(_SQL_INSERT_FILE, (file_id, user_id, filename, filepath, file_hash, file_size), trusted=True)
+            self._invalidate_files_cache(user_id)
             return True
         except Exception as e:
             logger.error(f"Error inserting file: {e}")
             return False
     
+    def insert_file_with_boq(self, file_id: str, user_id: str, filename: str, filepath: str, file_hash: str, file_size: int, boq_data: str) -> bool:
+        """Insert a file record with its BOQ data in one transaction
+
+        One INSERT instead of an INSERT followed by an UPDATE halves the
+        round trips and fsyncs on the upload path.
+        """
+        try:
+            self.execute_update(_SQL_INSERT_FILE_WITH_BOQ, (file_id, user_id, filename, filepath, file_hash, file_size, boq_data), trusted=True)
+            self._invalidate_files_cache(user_id)
+            return True
+        except Exception as e:
+            logger.error(f"Error inserting file with BOQ: {e}")
+            return False
+
     def update_file_boq(self, file_id: str, boq_data: str) -> bool:
         """Update BOQ data for a file"""
         try:
-            sql = """
-                UPDATE files 
-                SET boq_data = ?, updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            """
-            self.execute_update(sql, (boq_data, file_id))
+            self.execute_update(_SQL_UPDATE_FILE_BOQ, (boq_data, file_id), trusted=True)
+            # No user_id here, so take the conservative route
+            self._invalidate_files_cache()
             return True
         except Exception as e:
             logger.error(f"Error updating BOQ data: {e}")
             return False
     
-    def get_user_files(self, user_id: str) -> List[Dict[str, Any]]:
+    def get_user_files(self, user_id: str) -> List[sqlite3.Row]:
         """Get files for a specific user"""
+        key = ("user_files", user_id)
+        cached = self._files_cache_get(key)
+        if cached is not None:
+            return cached
         try:
-            sql = """
-                SELECT id, filename, uploaded_at, boq_data, file_size
-                FROM files 
-                WHERE user_id = ? 
-                ORDER BY uploaded_at DESC
-            """
-            return self.execute_query(sql, (user_id,))
+            results = self.execute_query(_SQL_GET_USER_FILES, (user_id,), trusted=True)
+            self._files_cache_put(key, results)
+            return results
         except Exception as e:
             logger.error(f"Error getting user files: {e}")
             return []
-    
-    def get_file_by_id(self, file_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+
+    def get_file_by_id(self, file_id: str, user_id: str) -> Optional[sqlite3.Row]:
         """Get a specific file by ID (user-specific)"""
+        key = ("file", file_id, user_id)
+        cached = self._files_cache_get(key)
+        if cached is not None:
+            return cached
         try:
-            sql = """
-                SELECT filepath, filename, boq_data
-                FROM files 
-                WHERE id = ? AND user_id = ?
-            """
-            results = self.execute_query(sql, (file_id, user_id))
-            return results[0] if results else None
+            results = self.execute_query(_SQL_GET_FILE_BY_ID, (file_id, user_id), trusted=True)
+            if results:
+                self._files_cache_put(key, results[0])
+                return results[0]
+            return None
         except Exception as e:
             logger.error(f"Error getting file by ID: {e}")
             return None
     
+    def _log_writer_loop(self):
+        """Drain queued security-log events and write them in batches"""
+        while True:
+            batch = [self._log_queue.get()]
+            deadline = time.monotonic() + self._log_flush_interval
+            while len(batch) < self._log_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._log_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                with self._get_connection() as conn:
+                    conn.executemany(_SQL_LOG_SECURITY_EVENT, batch)
+                    conn.commit()
+            except Exception as e:
+                logger.error(f"Error writing security log batch: {e}")
+
     def log_security_event(self, event_type: str, ip_address: str = None, user_id: str = None, details: str = None, severity: str = "INFO"):
-        """Log security events"""
+        """Queue a security event for batched writing"""
         try:
-            sql = """
-                INSERT INTO security_logs (event_type, ip_address, user_id, details, severity)
-                VALUES (?, ?, ?, ?, ?)
-            """
-            self.execute_update(sql, (event_type, ip_address, user_id, details, severity))
+            self._log_queue.put((event_type, ip_address, user_id, details, severity))
         except Exception as e:
             logger.error(f"Error logging security event: {e}")
     
     def cleanup_old_logs(self, days: int = 30):
-        """Clean up old security logs"""
+        """Clean up old security logs in bounded batches
+
+        Deleting in LIMIT-ed chunks with a bound cutoff keeps each write
+        transaction short, so concurrent writers are never stalled behind
+        one unbounded DELETE.
+        """
         try:
-            sql = """
-                DELETE FROM security_logs 
-                WHERE timestamp < datetime('now', '-{} days')
-            """.format(days)
-            self.execute_update(sql)
+            cutoff = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+            while self.execute_update(_SQL_CLEANUP_OLD_LOGS, (cutoff,), trusted=True) > 0:
+                pass
         except Exception as e:
             logger.error(f"Error cleaning up old logs: {e}")
     
     def get_file_hash(self, file_content: bytes) -> str:
-        """Generate secure hash for file content"""
+        """Generate secure hash for file content
+
+        BLAKE3 hashes large uploads several times faster than SHA256 and
+        produces the same 64-char hex digest; SHA256 remains the fallback
+        when the wheel is not installed.
+        """
+        if blake3 is not None:
+            return blake3(file_content).hexdigest()
         return hashlib.sha256(file_content).hexdigest()
+
+    def get_file_hasher(self):
+        """Create an incremental hasher matching get_file_hash's algorithm"""
+        return blake3() if blake3 is not None else hashlib.sha256()
     
     def verify_file_integrity(self, file_id: str, expected_hash: str) -> bool:
         """Verify file integrity using hash"""
         try:
-            sql = "SELECT file_hash FROM files WHERE id = ?"
-            results = self.execute_query(sql, (file_id,))
+            results = self.execute_query(_SQL_GET_FILE_HASH, (file_id,), trusted=True)
             if results:
-                stored_hash = results[0].get('file_hash')
+                stored_hash = results[0]['file_hash']
                 return stored_hash == expected_hash
             return False
         except Exception as e:
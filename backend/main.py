@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from routes.files import router
+from fastapi.responses import ORJSONResponse
+from routes.files import router, get_boq_generator
 from middleware.security_middleware import (
     SecurityMiddleware, 
     InputValidationMiddleware, 
@@ -8,7 +9,7 @@ from middleware.security_middleware import (
     AuthenticationMiddleware
 )
 
-app = FastAPI(title="BOQMate API", version="1.0.0")
+app = FastAPI(title="BOQMate API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # Add security middleware (order matters!)
 app.add_middleware(SecurityMiddleware)
@@ -36,6 +37,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics")
+async def usage_metrics():
+    """Aggregated OpenAI token usage, including prompt-cache reads"""
+    return get_boq_generator().get_usage_metrics()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -1,5 +1,5 @@
 from fastapi import Request, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import Response
 import time
@@ -8,8 +8,24 @@ from security import security_manager
 
 logger = logging.getLogger(__name__)
 
+# Security headers added to every response, built once at import time
+SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "X-Frame-Options": "DENY",
+    "X-XSS-Protection": "1; mode=block",
+    "Strict-Transport-Security": "max-age=31536000; includeSubDomains",
+    "Content-Security-Policy": "default-src 'self'; script-src 'self' 'unsafe-inline'; style-src 'self' 'unsafe-inline'; img-src 'self' data: https:; font-src 'self' https:;",
+    "Referrer-Policy": "strict-origin-when-cross-origin",
+    "Permissions-Policy": "geolocation=(), microphone=(), camera=()"
+}
+
 class SecurityMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
+        # CORS preflights carry no body or credentials; skip the security
+        # checks and let CORSMiddleware answer them
+        if request.method == "OPTIONS":
+            return await call_next(request)
+
         # Get client IP
         client_ip = security_manager.get_client_ip(request)
         
@@ -20,14 +36,14 @@ class SecurityMiddleware(BaseHTTPMiddleware):
                 "path": request.url.path,
                 "method": request.method
             })
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=status.HTTP_403_FORBIDDEN,
                 content={"detail": "Access denied"}
             )
         
         # Rate limiting
-        if not security_manager.check_rate_limit(client_ip):
-            return JSONResponse(
+        if not await security_manager.check_rate_limit(client_ip):
+            return ORJSONResponse(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 content={"detail": "Rate limit exceeded"}
             )
@@ -36,20 +52,42 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         response = await call_next(request)
         
         # Add security headers
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        response.headers["X-Frame-Options"] = "DENY"
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        response.headers["Content-Security-Policy"] = "default-src 'self'; script-src 'self' 'unsafe-inline'; style-src 'self' 'unsafe-inline'; img-src 'self' data: https:; font-src 'self' https:;"
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        response.headers["Permissions-Policy"] = "geolocation=(), microphone=(), camera=()"
-        
+        response.headers.update(SECURITY_HEADERS)
+
         return response
 
+# InputValidationMiddleware only scans bodies up to this size; anything
+# larger is handled by the upload-specific checks
+MAX_SCANNED_BODY_SIZE = 1 << 20  # 1MB
+
+# Upload extensions accepted by /api/generate-boq; frozenset for O(1) lookup
+ALLOWED_UPLOAD_EXTENSIONS = frozenset({
+    'pdf', 'txt', 'docx', 'dwg', 'dxf', 'rvt', 'rfa', 'dgn', 'skp'
+})
+
 class InputValidationMiddleware(BaseHTTPMiddleware):
+    def _should_scan_body(self, request: Request) -> bool:
+        """Decide whether the request body is worth decoding and scanning"""
+        # File uploads and raw binary are validated by
+        # FileUploadSecurityMiddleware; decoding them as UTF-8 here would
+        # buffer the whole upload and scan megabytes of binary noise
+        content_type = request.headers.get("content-type", "")
+        if content_type.startswith("multipart/") or content_type.startswith("application/octet-stream"):
+            return False
+
+        try:
+            content_length = int(request.headers.get("content-length", "0"))
+        except ValueError:
+            content_length = 0
+        return content_length <= MAX_SCANNED_BODY_SIZE
+
     async def dispatch(self, request: Request, call_next):
+        # Skip CORS preflights entirely
+        if request.method == "OPTIONS":
+            return await call_next(request)
+
         # Validate request body for POST/PUT requests
-        if request.method in ["POST", "PUT", "PATCH"]:
+        if request.method in ["POST", "PUT", "PATCH"] and self._should_scan_body(request):
             try:
                 body = await request.body()
                 if body:
@@ -62,7 +100,7 @@ class InputValidationMiddleware(BaseHTTPMiddleware):
                             "method": request.method,
                             "body_preview": body_str[:100]
                         })
-                        return JSONResponse(
+                        return ORJSONResponse(
                             status_code=status.HTTP_400_BAD_REQUEST,
                             content={"detail": "Invalid input detected"}
                         )
@@ -78,7 +116,7 @@ class InputValidationMiddleware(BaseHTTPMiddleware):
                     "param": param_name,
                     "value": param_value
                 })
-                return JSONResponse(
+                return ORJSONResponse(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     content={"detail": "Invalid query parameter"}
                 )
@@ -90,6 +128,22 @@ class FileUploadSecurityMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         # Check if this is a file upload endpoint
         if request.url.path == "/api/generate-boq" and request.method == "POST":
+            # Reject oversized uploads from the header alone, before any
+            # multipart parsing
+            try:
+                content_length = int(request.headers.get("content-length", "0"))
+            except ValueError:
+                content_length = 0
+            if content_length > 50 * 1024 * 1024:  # 50MB
+                security_manager.log_security_event("FILE_TOO_LARGE", {
+                    "ip": security_manager.get_client_ip(request),
+                    "size": content_length
+                })
+                return ORJSONResponse(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    content={"detail": "File too large"}
+                )
+
             try:
                 # Get form data
                 form = await request.form()
@@ -110,42 +164,32 @@ class FileUploadSecurityMiddleware(BaseHTTPMiddleware):
                             })
                     
                     # Validate file type
-                    allowed_extensions = ['pdf', 'txt', 'docx', 'dwg', 'dxf', 'rvt', 'rfa', 'dgn', 'skp']
-                    if not security_manager.validate_file_type(filename, allowed_extensions):
+                    if not (filename and "." in filename
+                            and filename.rsplit(".", 1)[1].lower() in ALLOWED_UPLOAD_EXTENSIONS):
                         security_manager.log_security_event("INVALID_FILE_TYPE", {
                             "ip": security_manager.get_client_ip(request),
                             "filename": filename
                         })
-                        return JSONResponse(
+                        return ORJSONResponse(
                             status_code=status.HTTP_400_BAD_REQUEST,
                             content={"detail": "Invalid file type"}
                         )
                     
-                    # Check file size (limit to 50MB)
-                    file_content = await file.read()
-                    if len(file_content) > 50 * 1024 * 1024:  # 50MB
+                    # Check file size (limit to 50MB) without reading the
+                    # bytes into memory - content scanning happens in the
+                    # route handler, which reads the file exactly once
+                    file_size = getattr(file, "size", None)
+                    if file_size is not None and file_size > 50 * 1024 * 1024:  # 50MB
                         security_manager.log_security_event("FILE_TOO_LARGE", {
                             "ip": security_manager.get_client_ip(request),
                             "filename": filename,
-                            "size": len(file_content)
+                            "size": file_size
                         })
-                        return JSONResponse(
+                        return ORJSONResponse(
                             status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                             content={"detail": "File too large"}
                         )
-                    
-                    # Validate file content for malicious patterns
-                    file_content_str = file_content.decode('utf-8', errors='ignore')
-                    if not security_manager.validate_input(file_content_str):
-                        security_manager.log_security_event("MALICIOUS_FILE_CONTENT", {
-                            "ip": security_manager.get_client_ip(request),
-                            "filename": filename
-                        })
-                        return JSONResponse(
-                            status_code=status.HTTP_400_BAD_REQUEST,
-                            content={"detail": "File content validation failed"}
-                        )
-                
+
                 # Validate categories parameter if present
                 if "categories" in form:
                     categories = form["categories"]
@@ -154,14 +198,14 @@ class FileUploadSecurityMiddleware(BaseHTTPMiddleware):
                             "ip": security_manager.get_client_ip(request),
                             "categories": categories
                         })
-                        return JSONResponse(
+                        return ORJSONResponse(
                             status_code=status.HTTP_400_BAD_REQUEST,
                             content={"detail": "Invalid categories parameter"}
                         )
                         
             except Exception as e:
                 logger.error(f"Error in file upload security check: {e}")
-                return JSONResponse(
+                return ORJSONResponse(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     content={"detail": "File upload validation failed"}
                 )
@@ -171,9 +215,16 @@ class FileUploadSecurityMiddleware(BaseHTTPMiddleware):
 
 class AuthenticationMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
-        # Skip authentication for public endpoints
-        public_paths = ["/", "/health", "/api/categories"]
-        
+        # CORS preflights never carry an Authorization header; answering
+        # them with 401 would break every cross-origin POST
+        if request.method == "OPTIONS":
+            return await call_next(request)
+
+        # Skip authentication for public endpoints. /metrics carries
+        # only aggregate token counters (no user data) and is meant for
+        # scraping by monitoring, like /health.
+        public_paths = ["/", "/health", "/metrics", "/api/categories"]
+
         if request.url.path in public_paths:
             response = await call_next(request)
             return response
@@ -185,13 +236,13 @@ class AuthenticationMiddleware(BaseHTTPMiddleware):
                 "ip": security_manager.get_client_ip(request),
                 "path": request.url.path
             })
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 content={"detail": "Missing or invalid authorization header"}
             )
         
-        # Validate token
-        token = auth_header.split(" ")[1]
+        # Validate token (slice off the "Bearer " prefix checked above)
+        token = auth_header[7:]
         payload = security_manager.verify_token(token)
         
         if not payload:
@@ -199,13 +250,15 @@ class AuthenticationMiddleware(BaseHTTPMiddleware):
                 "ip": security_manager.get_client_ip(request),
                 "path": request.url.path
             })
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 content={"detail": "Invalid or expired token"}
             )
         
-        # Add user info to request state
-        request.state.user_id = payload.get("user_id")
-        
+        # Add user info to request state so dependencies like
+        # get_current_user can reuse the payload without a second decode
+        request.state.jwt_payload = payload
+        request.state.user_id = payload.get("sub") or payload.get("user_id")
+
         response = await call_next(request)
         return response
\ No newline at end of file
@@ -0,0 +1,64 @@
+"""
+Shared multi-pattern scanner for the SQL sanitizer and input validation.
+
+Each pattern set is compiled once at startup. When the optional hyperscan
+wheel is installed, scans run on its SIMD-accelerated engine; otherwise a
+single stdlib regex alternation is used, which is still one pass per input.
+"""
+
+import re
+from typing import List, Optional
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
+
+class MultiPatternScanner:
+    def __init__(self, patterns: List[str]):
+        self.patterns = list(patterns)
+        self._regex = re.compile(
+            "|".join(f"(?:{pattern})" for pattern in self.patterns),
+            re.IGNORECASE
+        )
+        self._hs_db = self._compile_hyperscan()
+
+    def _compile_hyperscan(self):
+        """Build a hyperscan database for the patterns, if available"""
+        if hyperscan is None:
+            return None
+        try:
+            db = hyperscan.Database()
+            db.compile(
+                expressions=[pattern.encode() for pattern in self.patterns],
+                ids=list(range(len(self.patterns))),
+                flags=[hyperscan.HS_FLAG_CASELESS] * len(self.patterns)
+            )
+            return db
+        except Exception:
+            # Not every regex feature compiles under hyperscan; fall back
+            return None
+
+    def scan(self, text: str) -> Optional[str]:
+        """Return the first offending match, or None if the text is clean"""
+        if self._hs_db is not None:
+            hits = []
+
+            def on_match(pattern_id, start, end, flags, context=None):
+                hits.append(pattern_id)
+                return 1  # terminate the scan on first hit
+
+            try:
+                self._hs_db.scan(
+                    text.encode("utf-8", errors="ignore"),
+                    match_event_handler=on_match
+                )
+            except hyperscan.error:
+                pass
+            if hits:
+                return self.patterns[hits[0]]
+            return None
+
+        match = self._regex.search(text)
+        return match.group(0) if match else None
@@ -1,14 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, status
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File, status
+from fastapi.responses import FileResponse, Response
+import aiofiles
+import asyncio
+import concurrent.futures
+import hashlib
 import os
 import uuid
-import json
+import orjson
 from datetime import datetime
+from functools import lru_cache
 from typing import List
 from pathlib import Path
 
 from auth import get_current_user
-from services.openai_service import BOQGenerator
+from services.openai_service import BOQGenerator, generate_boq_from_path
 from services.excel_service import ExcelExporter
 from database import db
 from security import security_manager
@@ -19,6 +24,40 @@ router = APIRouter()
 UPLOADS_DIR = Path("uploads")
 UPLOADS_DIR.mkdir(exist_ok=True)
 
+# Concurrency ceilings so a burst of uploads cannot exhaust file
+# descriptors or trip OpenAI rate limits
+_OPENAI_SEM = asyncio.BoundedSemaphore(int(os.getenv("OPENAI_CONCURRENCY", "8")))
+_DISK_SEM = asyncio.BoundedSemaphore(32)
+
+# Characters of the previous chunk re-scanned with the next one, so a
+# suspicious pattern split across a chunk boundary still matches
+_SCAN_OVERLAP = 256
+
+# BOQ generation parses PDFs/DOCX/CAD files - seconds of CPU that would
+# otherwise block the event loop; run it in worker processes instead
+_BOQ_POOL = concurrent.futures.ProcessPoolExecutor(
+    max_workers=int(os.getenv("BOQ_WORKERS", str(os.cpu_count() or 2)))
+)
+
+@lru_cache(maxsize=1)
+def get_boq_generator() -> BOQGenerator:
+    """Shared BOQGenerator - building the category table and the OpenAI
+    client (with its TLS session) per request was pure overhead"""
+    return BOQGenerator()
+
+@lru_cache(maxsize=1)
+def get_excel_exporter() -> ExcelExporter:
+    """Shared ExcelExporter - create_boq_excel has no awaits, so requests
+    on the event loop never interleave inside it"""
+    return ExcelExporter()
+
+@lru_cache(maxsize=1)
+def _categories_payload() -> tuple:
+    """Serialized category table plus its ETag, computed once - the table
+    is static for the life of the process"""
+    body = orjson.dumps(get_boq_generator().get_available_categories())
+    return body, hashlib.md5(body).hexdigest()
+
 @router.post("/api/generate-boq")
 async def generate_boq(
     file: UploadFile = File(...),
@@ -36,47 +75,73 @@ async def generate_boq(
         user_dir = UPLOADS_DIR / user_id
         user_dir.mkdir(exist_ok=True)
         
-        # Save file
+        # Save file, streaming in 1MB chunks so a 50MB upload never sits
+        # fully in memory; hash and content-scan each chunk in the same pass
         file_path = user_dir / f"{file_id}_{file.filename}"
-        content = await file.read()
-        with open(file_path, "wb") as buffer:
-            buffer.write(content)
-        
-        # Generate file hash for integrity
-        file_hash = db.get_file_hash(content)
-        
-        # Save file metadata to database securely
-        if not db.insert_file(file_id, user_id, file.filename, str(file_path), file_hash, len(content)):
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to save file metadata"
-            )
-        
+        hasher = db.get_file_hasher()
+        file_size = 0
+        scan_tail = ""
+        async with _DISK_SEM:
+            async with aiofiles.open(file_path, "wb") as out:
+                while chunk := await file.read(1 << 20):
+                    # scan_file_chunk, not validate_input: the string
+                    # validator's 10KB length rule would reject any
+                    # upload past the first chunk boundary
+                    chunk_text = chunk.decode('utf-8', errors='ignore')
+                    if not security_manager.scan_file_chunk(scan_tail + chunk_text):
+                        security_manager.log_security_event("MALICIOUS_FILE_CONTENT", {
+                            "user_id": user_id,
+                            "filename": file.filename
+                        })
+                        file_path.unlink(missing_ok=True)
+                        raise HTTPException(
+                            status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="File content validation failed"
+                        )
+                    scan_tail = chunk_text[-_SCAN_OVERLAP:]
+                    hasher.update(chunk)
+                    file_size += len(chunk)
+                    await out.write(chunk)
+        file_hash = hasher.hexdigest()
+
         # Parse selected categories
         selected_categories = []
         if categories:
             selected_categories = [cat.strip() for cat in categories.split(',') if cat.strip()]
         
-        # Generate BOQ using OpenAI
-        boq_generator = BOQGenerator()
-        boq_items = boq_generator.generate_boq(content, file.filename, selected_categories)
-        
+        # Generate BOQ in a worker process: the worker re-reads the file
+        # from disk and runs extraction plus the OpenAI call off the loop
+        loop = asyncio.get_running_loop()
+        async with _OPENAI_SEM:
+            boq_items, usage_delta = await loop.run_in_executor(
+                _BOQ_POOL, generate_boq_from_path,
+                str(file_path), file.filename, tuple(selected_categories)
+            )
+
+        # The OpenAI call ran in a pool worker with its own counters;
+        # fold its usage into this process so /metrics sees real traffic
+        get_boq_generator().merge_usage_metrics(usage_delta)
+
         # Validate BOQ data
-        if not boq_generator.validate_boq_data(boq_items):
+        if not get_boq_generator().validate_boq_data(boq_items):
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Generated BOQ data is invalid"
             )
         
-        # Update database with BOQ data securely
-        if not db.update_file_boq(file_id, json.dumps(boq_items)):
+        # Persist metadata and BOQ together - one write instead of an
+        # insert before generation and an update after it
+        if not db.insert_file_with_boq(file_id, user_id, file.filename, str(file_path),
+                                       file_hash, file_size, orjson.dumps(boq_items).decode()):
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to save BOQ data"
             )
         
         return boq_items
-        
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -84,13 +149,17 @@ async def generate_boq(
         )
 
 @router.get("/api/categories")
-async def get_categories():
+async def get_categories(request: Request):
     """
     Get available construction categories for BOQ generation
     """
     try:
-        boq_generator = BOQGenerator()
-        return boq_generator.get_available_categories()
+        body, etag = _categories_payload()
+        headers = {"Cache-Control": "public, max-age=3600", "ETag": etag}
+        # Most repeat calls carry the ETag back and get an empty 304
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -110,7 +179,7 @@ async def list_files(user_id: str = Depends(get_current_user)):
                 "id": row["id"],
                 "filename": row["filename"],
                 "uploaded_at": row["uploaded_at"],
-                "boq_data": json.loads(row["boq_data"]) if row["boq_data"] else None
+                "boq_data": orjson.loads(row["boq_data"]) if row["boq_data"] else None
             })
         return files
         
@@ -135,16 +204,23 @@ async def download_file(file_id: str, user_id: str = Depends(get_current_user)):
             )
         
         file_path = Path(file_data["filepath"])
-        if not file_path.exists():
+        try:
+            stat_result = os.stat(file_path)
+        except FileNotFoundError:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="File not found on disk"
             )
-        
+
+        # FileResponse lets the server use zero-copy sendfile() where the
+        # ASGI extension supports it, and handles Range requests so large
+        # downloads can resume; passing stat_result avoids a second stat
         return FileResponse(
-            path=str(file_path),
+            file_path,
+            media_type="application/octet-stream",
             filename=file_data["filename"],
-            media_type="application/octet-stream"
+            stat_result=stat_result,
+            headers={"Accept-Ranges": "bytes"}
         )
         
     except HTTPException:
@@ -170,11 +246,10 @@ async def download_boq(file_id: str, user_id: str = Depends(get_current_user)):
             )
         
         # Parse BOQ data
-        boq_data = json.loads(file_data["boq_data"])
+        boq_data = orjson.loads(file_data["boq_data"])
         
         # Create Excel file
-        excel_exporter = ExcelExporter()
-        excel_content = excel_exporter.create_boq_excel(boq_data, file_data["filename"])
+        excel_content = get_excel_exporter().create_boq_excel(boq_data, file_data["filename"])
         
         # Create response with Excel file
         from fastapi.responses import Response
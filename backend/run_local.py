@@ -68,20 +68,30 @@ def main():
     print("💚 Health Check: http://localhost:8000/health")
     
     try:
-        # Import and run the FastAPI app
-        from main import app
-        
+        # Import check only - uvicorn needs the import string below so it
+        # can re-import the app in each worker process
+        import main  # noqa: F401
+
+        # A single reloader worker serializes every upload behind one
+        # process; default to multiple workers with the C http parser and
+        # uvloop, and make auto-reload opt-in via RELOAD=1 (workers and
+        # reload are mutually exclusive in uvicorn). uvloop does not
+        # build on Windows, so fall back to uvicorn's default loop there.
+        reload = os.getenv("RELOAD", "0") == "1"
         uvicorn.run(
-            app,
+            "main:app",
             host="0.0.0.0",
             port=8000,
-            reload=True,
+            workers=None if reload else int(os.getenv("WORKERS", "4")),
+            reload=reload,
+            http="httptools",
+            loop="uvloop" if sys.platform != "win32" else "auto",
             log_level="info"
         )
     except ImportError as e:
         print(f"❌ Error importing application: {e}")
         print("Make sure all dependencies are installed:")
-        print("pip install fastapi uvicorn python-multipart python-jose requests openai PyPDF2 python-docx ezdxf openpyxl cryptography bcrypt passlib")
+        print("pip install fastapi uvicorn[standard] uvloop httptools python-multipart python-jose requests openai PyPDF2 python-docx ezdxf openpyxl cryptography bcrypt passlib")
         sys.exit(1)
     except Exception as e:
         print(f"❌ Error starting server: {e}")
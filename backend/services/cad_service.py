@@ -1,47 +1,144 @@
 import ezdxf
+import io
+import math
+import numpy as np
 import os
 from typing import Dict, Any, List
-import json
+import orjson
+
+# Static analysis messages for the formats we cannot parse directly,
+# pre-rendered once and picked by a dict lookup instead of an elif chain
+_DWG_MSG = """
+CAD File Analysis:
+- Filename: {filename}
+- Format: DWG (AutoCAD Drawing)
+- Note: DWG files require specialized processing tools
+- Recommendation: Convert to DXF format for better analysis
+            """
+
+_REVIT_MSG = """
+CAD File Analysis:
+- Filename: {filename}
+- Format: {format} (Revit File)
+- Note: Revit files require Autodesk Revit or specialized tools
+- Recommendation: Export to IFC or DXF format for analysis
+            """
+
+_DGN_MSG = """
+CAD File Analysis:
+- Filename: {filename}
+- Format: DGN (MicroStation Design File)
+- Note: DGN files require Bentley MicroStation or specialized tools
+- Recommendation: Convert to DXF format for analysis
+            """
+
+_SKP_MSG = """
+CAD File Analysis:
+- Filename: {filename}
+- Format: SKP (SketchUp Model)
+- Note: SketchUp files require SketchUp or specialized tools
+- Recommendation: Export to DXF or IFC format for analysis
+            """
+
+_UNSUPPORTED_MSG = """
+CAD File Analysis:
+- Filename: {filename}
+- Format: {format}
+- Note: Unsupported CAD format
+- Recommendation: Convert to DXF format for analysis
+            """
+
+_FORMAT_MESSAGES = {
+    'dwg': _DWG_MSG,
+    'rvt': _REVIT_MSG,
+    'rfa': _REVIT_MSG,
+    'dgn': _DGN_MSG,
+    'skp': _SKP_MSG,
+}
 
 class CADProcessor:
     def __init__(self):
         self.supported_formats = ['.dwg', '.dxf', '.rvt', '.rfa', '.dgn', '.skp']
+        # Memoizes extract_quantities_from_cad per analysis string, so a
+        # re-run over the same file skips the parse and reductions
+        self._quantities_cache = {}
     
     def process_dxf_file(self, file_content: bytes, filename: str) -> str:
         """Process DXF files using ezdxf"""
         try:
-            # Create a temporary file to process with ezdxf
-            import tempfile
-            with tempfile.NamedTemporaryFile(suffix='.dxf', delete=False) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-            
-            # Read DXF file
-            doc = ezdxf.read(temp_file_path)
+            # Parse straight from memory: the bytes are already in hand,
+            # so writing a temp file for ezdxf to re-read from disk just
+            # doubled the I/O per upload
+            stream = io.TextIOWrapper(io.BytesIO(file_content), encoding='utf-8', errors='ignore')
+            try:
+                doc = ezdxf.read(stream)
+            except ezdxf.DXFError:
+                # Binary DXF - ezdxf needs a real file for those
+                import tempfile
+                with tempfile.NamedTemporaryFile(suffix='.dxf', delete=False) as temp_file:
+                    temp_file.write(file_content)
+                    temp_file_path = temp_file.name
+                try:
+                    doc = ezdxf.readfile(temp_file_path)
+                finally:
+                    os.unlink(temp_file_path)
             msp = doc.modelspace()
             
-            # Extract information from DXF
+            # Extract information from DXF. Only the first 50 entities get
+            # a full dict (that is all the analysis ever used); past that
+            # we keep cheap running counters instead of allocating per
+            # entity and throwing the result away.
             entities_info = []
-            
+            layers = set()
+            entity_types = set()
+            total_entities = 0
+            # Geometry gathered for every entity so quantity extraction
+            # can vectorize over it (and is no longer capped at 50)
+            radii = []
+            lengths = []
+            text_elements = 0
+
             for entity in msp:
                 entity_type = entity.dxftype()
+                dxf = entity.dxf  # attribute lookups dominate this loop
+                layer = dxf.get('layer', 'Unknown')
+
+                total_entities += 1
+                layers.add(layer)
+                entity_types.add(entity_type)
+
+                length = radius = None
+                if entity_type == 'LINE':
+                    start, end = dxf.start, dxf.end
+                    length = math.hypot(end.x - start.x, end.y - start.y)
+                    lengths.append(length)
+                elif entity_type == 'CIRCLE':
+                    radius = dxf.radius
+                    radii.append(radius)
+                elif entity_type == 'TEXT':
+                    text_elements += 1
+
+                if len(entities_info) >= 50:
+                    continue
+
                 entity_info = {
                     'type': entity_type,
-                    'layer': getattr(entity, 'dxf', {}).get('layer', 'Unknown'),
+                    'layer': layer,
                 }
-                
+
                 # Extract specific information based on entity type
                 if entity_type == 'LINE':
                     entity_info.update({
-                        'start': (entity.dxf.start.x, entity.dxf.start.y),
-                        'end': (entity.dxf.end.x, entity.dxf.end.y),
-                        'length': entity.dxf.start.distance(entity.dxf.end)
+                        'start': (start.x, start.y),
+                        'end': (end.x, end.y),
+                        'length': length
                     })
                 elif entity_type == 'CIRCLE':
+                    center = dxf.center
                     entity_info.update({
-                        'center': (entity.dxf.center.x, entity.dxf.center.y),
-                        'radius': entity.dxf.radius,
-                        'area': 3.14159 * entity.dxf.radius ** 2
+                        'center': (center.x, center.y),
+                        'radius': radius,
+                        'area': math.pi * radius ** 2
                     })
                 elif entity_type == 'POLYLINE':
                     points = list(entity.get_points())
@@ -50,84 +147,59 @@ class CADProcessor:
                         'points': [(p[0], p[1]) for p in points]
                     })
                 elif entity_type == 'TEXT':
+                    insert = dxf.insert
                     entity_info.update({
-                        'text': entity.dxf.text,
-                        'position': (entity.dxf.insert.x, entity.dxf.insert.y)
+                        'text': dxf.text,
+                        'position': (insert.x, insert.y)
                     })
-                
+
                 entities_info.append(entity_info)
-            
-            # Clean up temporary file
-            os.unlink(temp_file_path)
-            
+
             # Create a summary of the CAD file
             summary = {
                 'filename': filename,
                 'format': 'DXF',
-                'total_entities': len(entities_info),
-                'layers': list(set(e['layer'] for e in entities_info)),
-                'entity_types': list(set(e['type'] for e in entities_info)),
-                'entities': entities_info[:50]  # Limit to first 50 entities for analysis
+                'total_entities': total_entities,
+                'layers': list(layers),
+                'entity_types': list(entity_types),
+                'radii': radii,
+                'lengths': lengths,
+                'text_elements': text_elements,
+                'entities': entities_info  # First 50 entities for analysis
             }
             
-            return json.dumps(summary, indent=2)
+            return orjson.dumps(summary, option=orjson.OPT_INDENT_2).decode()
             
         except Exception as e:
             return f"Error processing DXF file: {str(e)}"
     
     def process_cad_file(self, file_content: bytes, filename: str) -> str:
         """Process various CAD file formats"""
-        file_extension = filename.lower().split('.')[-1]
-        
+        # splitext avoids the list allocation of split('.') and handles
+        # dotted names the same way
+        file_extension = os.path.splitext(filename)[1][1:].lower()
+
         if file_extension == 'dxf':
             return self.process_dxf_file(file_content, filename)
-        elif file_extension == 'dwg':
-            # DWG files require additional libraries like ODA File Converter
-            # For now, return a generic analysis
-            return f"""
-CAD File Analysis:
-- Filename: {filename}
-- Format: DWG (AutoCAD Drawing)
-- Note: DWG files require specialized processing tools
-- Recommendation: Convert to DXF format for better analysis
-            """
-        elif file_extension in ['rvt', 'rfa']:
-            return f"""
-CAD File Analysis:
-- Filename: {filename}
-- Format: {file_extension.upper()} (Revit File)
-- Note: Revit files require Autodesk Revit or specialized tools
-- Recommendation: Export to IFC or DXF format for analysis
-            """
-        elif file_extension == 'dgn':
-            return f"""
-CAD File Analysis:
-- Filename: {filename}
-- Format: DGN (MicroStation Design File)
-- Note: DGN files require Bentley MicroStation or specialized tools
-- Recommendation: Convert to DXF format for analysis
-            """
-        elif file_extension == 'skp':
-            return f"""
-CAD File Analysis:
-- Filename: {filename}
-- Format: SKP (SketchUp Model)
-- Note: SketchUp files require SketchUp or specialized tools
-- Recommendation: Export to DXF or IFC format for analysis
-            """
-        else:
-            return f"""
-CAD File Analysis:
-- Filename: {filename}
-- Format: {file_extension.upper()}
-- Note: Unsupported CAD format
-- Recommendation: Convert to DXF format for analysis
-            """
+        # DWG and friends require external tools (ODA File Converter,
+        # Revit, MicroStation, SketchUp); return the canned analysis
+        template = _FORMAT_MESSAGES.get(file_extension, _UNSUPPORTED_MSG)
+        return template.format(filename=filename, format=file_extension.upper())
     
     def extract_quantities_from_cad(self, cad_analysis: str) -> Dict[str, Any]:
         """Extract quantities from CAD analysis for BOQ generation"""
+        cached = self._quantities_cache.get(cad_analysis)
+        if cached is not None:
+            return cached
+        quantities = self._extract_quantities(cad_analysis)
+        if len(self._quantities_cache) >= 128:
+            self._quantities_cache.clear()
+        self._quantities_cache[cad_analysis] = quantities
+        return quantities
+
+    def _extract_quantities(self, cad_analysis: str) -> Dict[str, Any]:
         try:
-            analysis_data = json.loads(cad_analysis)
+            analysis_data = orjson.loads(cad_analysis)
             
             quantities = {
                 'total_entities': analysis_data.get('total_entities', 0),
@@ -137,19 +209,28 @@ CAD File Analysis:
                 'estimated_length': 0,
                 'text_elements': 0
             }
-            
-            # Calculate estimated quantities from entities
-            for entity in analysis_data.get('entities', []):
-                if entity.get('type') == 'CIRCLE':
-                    quantities['estimated_area'] += entity.get('area', 0)
-                elif entity.get('type') == 'LINE':
-                    quantities['estimated_length'] += entity.get('length', 0)
-                elif entity.get('type') == 'TEXT':
-                    quantities['text_elements'] += 1
-            
+
+            if 'radii' in analysis_data or 'lengths' in analysis_data:
+                # Vectorized over the geometry arrays the parser emits:
+                # sum(pi*r^2) is one dot product, lengths one reduction
+                radii = np.asarray(analysis_data.get('radii', []), dtype=np.float64)
+                lengths = np.asarray(analysis_data.get('lengths', []), dtype=np.float64)
+                quantities['estimated_area'] = float(np.pi * np.dot(radii, radii))
+                quantities['estimated_length'] = float(lengths.sum())
+                quantities['text_elements'] = analysis_data.get('text_elements', 0)
+            else:
+                # Older analyses only carry the per-entity dicts
+                for entity in analysis_data.get('entities', []):
+                    if entity.get('type') == 'CIRCLE':
+                        quantities['estimated_area'] += entity.get('area', 0)
+                    elif entity.get('type') == 'LINE':
+                        quantities['estimated_length'] += entity.get('length', 0)
+                    elif entity.get('type') == 'TEXT':
+                        quantities['text_elements'] += 1
+
             return quantities
             
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             # If not JSON, return basic analysis
             return {
                 'total_entities': 0,
@@ -7,10 +7,15 @@ Validates security configuration and starts the application securely
 import os
 import sys
 import logging
-import subprocess
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+from importlib.util import find_spec
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+
+# (passed, errors, warnings) returned by each security check
+CheckResult = Tuple[bool, List[str], List[str]]
 
 # Configure logging
 logging.basicConfig(
@@ -37,36 +42,44 @@ class SecureStartup:
         
         self.security_warnings = []
         self.security_errors = []
-    
-    def check_environment_variables(self) -> bool:
+
+        # One snapshot of the environment instead of a getenv call per
+        # variable per check; derived ints parse once via cached_property
+        self._env = dict(os.environ)
+
+    @cached_property
+    def _rate_limit(self) -> int:
+        return int(self._env.get("RATE_LIMIT_REQUESTS", "100"))
+
+    @cached_property
+    def _max_file_size(self) -> int:
+        return int(self._env.get("MAX_FILE_SIZE", "52428800"))
+
+    def check_environment_variables(self) -> CheckResult:
         """Check if required environment variables are set"""
         logger.info("Checking environment variables...")
-        
-        missing_required = []
-        missing_recommended = []
-        
+
+        errors = []
+        warnings = []
+
         # Check required variables
         for var in self.required_env_vars:
-            if not os.getenv(var):
-                missing_required.append(var)
-            elif self._is_default_value(var, os.getenv(var)):
-                self.security_warnings.append(f"{var} is using default value - CHANGE THIS!")
-        
+            value = self._env.get(var)
+            if not value:
+                errors.append(f"Missing required environment variable: {var}")
+            elif self._is_default_value(var, value):
+                warnings.append(f"{var} is using default value - CHANGE THIS!")
+
+        if errors:
+            return False, errors, warnings
+
         # Check recommended variables
         for var in self.recommended_env_vars:
-            if not os.getenv(var):
-                missing_recommended.append(var)
-        
-        # Report results
-        if missing_required:
-            self.security_errors.extend([f"Missing required environment variable: {var}" for var in missing_required])
-            return False
-        
-        if missing_recommended:
-            self.security_warnings.extend([f"Missing recommended environment variable: {var}" for var in missing_recommended])
-        
+            if not self._env.get(var):
+                warnings.append(f"Missing recommended environment variable: {var}")
+
         logger.info("Environment variables check completed")
-        return True
+        return True, errors, warnings
     
     def _is_default_value(self, var: str, value: str) -> bool:
         """Check if environment variable is using default value"""
@@ -77,78 +90,80 @@ class SecureStartup:
         }
         return value == default_values.get(var, "")
     
-    def check_file_permissions(self) -> bool:
+    def check_file_permissions(self) -> CheckResult:
         """Check file permissions for security"""
         logger.info("Checking file permissions...")
-        
+
         critical_files = [
             "boqmate.db",
             "uploads/",
             ".env"
         ]
-        
+
+        warnings = []
         for file_path in critical_files:
             path = Path(file_path)
             if path.exists():
                 # Check if files are readable by others
                 if path.stat().st_mode & 0o077:
-                    self.security_warnings.append(f"File {file_path} has loose permissions")
-        
+                    warnings.append(f"File {file_path} has loose permissions")
+
         logger.info("File permissions check completed")
-        return True
+        return True, [], warnings
     
-    def check_dependencies(self) -> bool:
+    def check_dependencies(self) -> CheckResult:
         """Check if all security dependencies are installed"""
         logger.info("Checking security dependencies...")
-        
-        required_packages = [
-            "cryptography",
-            "bcrypt",
-            "passlib",
-            "python-jose[cryptography]"
-        ]
-        
-        missing_packages = []
-        
-        for package in required_packages:
-            try:
-                __import__(package.replace("[cryptography]", ""))
-            except ImportError:
-                missing_packages.append(package)
-        
-        if missing_packages:
-            self.security_errors.extend([f"Missing security package: {pkg}" for pkg in missing_packages])
-            return False
-        
+
+        # Package name -> import name (they differ for python-jose)
+        required_packages = {
+            "cryptography": "cryptography",
+            "bcrypt": "bcrypt",
+            "passlib": "passlib",
+            "python-jose[cryptography]": "jose"
+        }
+
+        errors = []
+
+        for package, module in required_packages.items():
+            # find_spec only resolves the module, so the probe costs
+            # microseconds instead of actually importing crypto code the
+            # startup script never runs
+            if find_spec(module) is None:
+                errors.append(f"Missing security package: {package}")
+
+        if errors:
+            return False, errors, []
+
         logger.info("Dependencies check completed")
-        return True
+        return True, [], []
     
-    def validate_security_config(self) -> bool:
+    def validate_security_config(self) -> CheckResult:
         """Validate security configuration"""
         logger.info("Validating security configuration...")
-        
+
+        warnings = []
+
         # Check rate limiting
-        rate_limit = int(os.getenv("RATE_LIMIT_REQUESTS", "100"))
-        if rate_limit > 1000:
-            self.security_warnings.append("Rate limit is very high - consider reducing")
-        
+        if self._rate_limit > 1000:
+            warnings.append("Rate limit is very high - consider reducing")
+
         # Check file size limits
-        max_file_size = int(os.getenv("MAX_FILE_SIZE", "52428800"))
-        if max_file_size > 100 * 1024 * 1024:  # 100MB
-            self.security_warnings.append("File size limit is very large - consider reducing")
-        
+        if self._max_file_size > 100 * 1024 * 1024:  # 100MB
+            warnings.append("File size limit is very large - consider reducing")
+
         # Check CORS configuration
-        allowed_origins = os.getenv("ALLOWED_ORIGINS", "http://localhost:3000")
+        allowed_origins = self._env.get("ALLOWED_ORIGINS", "http://localhost:3000")
         if "*" in allowed_origins:
-            self.security_warnings.append("CORS allows all origins - restrict for production")
-        
+            warnings.append("CORS allows all origins - restrict for production")
+
         logger.info("Security configuration validation completed")
-        return True
+        return True, [], warnings
     
-    def check_database_security(self) -> bool:
+    def check_database_security(self) -> CheckResult:
         """Check database security"""
         logger.info("Checking database security...")
-        
+
         db_path = Path("boqmate.db")
         if db_path.exists():
             # Check if database is accessible
@@ -158,51 +173,53 @@ class SecureStartup:
                 conn.execute("SELECT 1")
                 conn.close()
                 logger.info("Database security check completed")
-                return True
+                return True, [], []
             except Exception as e:
-                self.security_errors.append(f"Database security check failed: {e}")
-                return False
-        
+                return False, [f"Database security check failed: {e}"], []
+
         logger.info("Database not found - will be created on first run")
-        return True
+        return True, [], []
     
     def start_security_monitor(self):
         """Start security monitoring in background"""
         try:
             logger.info("Starting security monitor...")
-            monitor_process = subprocess.Popen([
-                sys.executable, "security_monitor.py"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            # Give it a moment to start
-            time.sleep(2)
-            
-            if monitor_process.poll() is None:
-                logger.info("Security monitor started successfully")
-                return monitor_process
-            else:
-                logger.warning("Security monitor failed to start")
-                return None
+            # Daemon thread in this process instead of a subprocess: no
+            # second interpreter boot, no sleep-and-poll startup race,
+            # and it dies with the app
+            from security_monitor import SecurityMonitor
+            monitor_thread = threading.Thread(
+                target=SecurityMonitor().start_monitoring,
+                name="security-monitor",
+                daemon=True
+            )
+            monitor_thread.start()
+            logger.info("Security monitor started successfully")
+            return monitor_thread
         except Exception as e:
             logger.error(f"Error starting security monitor: {e}")
             return None
-    
+
     def start_application(self):
-        """Start the main application"""
+        """Start the main application
+
+        Runs uvicorn in-process rather than via subprocess.Popen, which
+        re-imported the whole interpreter and cost a second process just
+        to serve the app. Blocks until the server exits.
+        """
         logger.info("Starting BOQMate application...")
-        
+
         try:
-            # Start the FastAPI application
-            app_process = subprocess.Popen([
-                sys.executable, "-m", "uvicorn", "main:app", 
-                "--host", "0.0.0.0", "--port", "8000"
-            ])
-            
+            import uvicorn
+            from main import app
+            config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="info")
+            server = uvicorn.Server(config)
             logger.info("BOQMate application started successfully")
-            return app_process
+            server.run()
+            return True
         except Exception as e:
             logger.error(f"Error starting application: {e}")
-            return None
+            return False
     
     def run_security_checks(self) -> bool:
         """Run all security checks"""
@@ -215,12 +232,21 @@ class SecureStartup:
             self.validate_security_config,
             self.check_database_security
         ]
-        
+
+        # The checks are I/O bound (stat calls, module probes, a sqlite
+        # open), so overlapping them makes startup cost the slowest
+        # check instead of the sum. Each returns its own result lists,
+        # which are folded in fixed order so the report stays stable.
+        with ThreadPoolExecutor(max_workers=len(checks)) as executor:
+            results = list(executor.map(lambda check: check(), checks))
+
         all_passed = True
-        for check in checks:
-            if not check():
+        for passed, errors, warnings in results:
+            self.security_errors.extend(errors)
+            self.security_warnings.extend(warnings)
+            if not passed:
                 all_passed = False
-        
+
         return all_passed
     
     def print_security_report(self):
@@ -257,29 +283,18 @@ class SecureStartup:
         # Print security report
         self.print_security_report()
         
-        # Start security monitor
-        monitor_process = self.start_security_monitor()
-        
-        # Start main application
-        app_process = self.start_application()
-        
-        if not app_process:
-            logger.error("Failed to start application")
-            if monitor_process:
-                monitor_process.terminate()
-            sys.exit(1)
-        
-        logger.info("BOQMate started successfully with security monitoring")
-        
+        # Start security monitor (daemon thread - exits with the app)
+        self.start_security_monitor()
+
+        # Start main application; blocks until the server stops
         try:
-            # Wait for processes
-            app_process.wait()
+            if not self.start_application():
+                logger.error("Failed to start application")
+                sys.exit(1)
         except KeyboardInterrupt:
-            logger.info("Shutting down BOQMate...")
-            app_process.terminate()
-            if monitor_process:
-                monitor_process.terminate()
-            logger.info("BOQMate stopped")
+            pass
+
+        logger.info("BOQMate stopped")
 
 def main():
     """Main function"""